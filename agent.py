@@ -1,11 +1,22 @@
 """Autonomous research agent -- runs on a schedule, discovers insights, generates daily plans."""
 
-import json
+import asyncio
 from datetime import datetime, timezone, date
 
-from db import execute, execute_one, get_conn
-from services.akash import generate_research_queries, synthesize_research, generate_daily_plan
-from services.yousearch import search_and_format
+import orjson
+
+from db import execute, execute_one, execute_tuples, conn_ctx
+from llm_cache import acached_llm, purge_expired
+from services import clients
+from services.akash import agenerate_research_queries, asynthesize_research, generate_daily_plan
+from services.yousearch import asearch_and_format
+
+# Max rabbit holes researched at once; keeps us under the Akash/You.com rate limits.
+MAX_CONCURRENCY = 5
+# Identical queries (across holes or cycles) reuse You.com results for this long
+SEARCH_CACHE_TTL = 6 * 3600
+# Chars of formatted search results kept per query, bounding the synthesis prompt size
+RESULTS_BUDGET_PER_QUERY = 2500
 
 
 def get_stale_rabbit_holes(limit: int = 5) -> list[dict]:
@@ -21,73 +32,77 @@ def get_stale_rabbit_holes(limit: int = 5) -> list[dict]:
     )
 
 
-def get_recent_insights(rabbit_hole_id: int, limit: int = 3) -> str:
-    """Get recent insights for a rabbit hole as a formatted string."""
-    rows = execute(
-        """SELECT content, created_at FROM insights
-           WHERE rabbit_hole_id = %s
-           ORDER BY created_at DESC LIMIT %s""",
-        (rabbit_hole_id, limit),
-        fetch=True,
+def get_recent_insights(rabbit_hole_ids: list[int], limit: int = 3) -> dict[int, str]:
+    """Get recent insights for several rabbit holes in one query, formatted per hole."""
+    rows = execute_tuples(
+        """SELECT rabbit_hole_id, content, created_at FROM (
+               SELECT rabbit_hole_id, content, created_at,
+                      ROW_NUMBER() OVER (PARTITION BY rabbit_hole_id ORDER BY created_at DESC) AS rn
+               FROM insights
+               WHERE rabbit_hole_id = ANY(%s)
+           ) ranked
+           WHERE rn <= %s
+           ORDER BY rabbit_hole_id, created_at DESC""",
+        (list(rabbit_hole_ids), limit),
     )
-    if not rows:
-        return ""
-    return "\n".join(f"- [{r['created_at']}] {r['content'][:200]}" for r in rows)
+    recent = {}
+    for rh_id, content, created_at in rows:
+        recent.setdefault(rh_id, []).append(f"- [{created_at}] {content[:200]}")
+    return {rh_id: "\n".join(lines) for rh_id, lines in recent.items()}
 
 
-def research_rabbit_hole(rh: dict) -> dict:
+async def research_rabbit_hole(rh: dict, recent: str = "") -> dict:
     """Run a full research cycle on a single rabbit hole."""
     rh_id = rh["id"]
     name = rh["name"]
     desc = rh["description"] or ""
 
-    recent = get_recent_insights(rh_id)
-
-    # Step 1: Generate search queries via DeepSeek
-    queries = generate_research_queries(name, desc, recent)
+    # Step 1: Generate search queries via DeepSeek (not cached: `recent` includes the insight
+    # the previous run just wrote, so the inputs never repeat)
+    queries = await agenerate_research_queries(name, desc, recent)
     print(f"  Generated queries: {queries}")
 
-    # Step 2: Search You.com for each query
-    all_results = []
-    for q in queries:
-        formatted = search_and_format(q, num_results=3)
-        all_results.append(f"Query: {q}\n{formatted}")
+    # Step 2: Search You.com for all queries concurrently
+    results = await asyncio.gather(
+        *(acached_llm(asearch_and_format, q, 3, ttl=SEARCH_CACHE_TTL) for q in queries)
+    )
+    all_results = [
+        f"Query: {q}\n{formatted[:RESULTS_BUDGET_PER_QUERY]}" for q, formatted in zip(queries, results)
+    ]
 
     combined_results = "\n\n---\n\n".join(all_results)
 
     # Step 3: Synthesize with DeepSeek
-    synthesis = synthesize_research(name, desc, combined_results)
+    synthesis = await asynthesize_research(name, desc, combined_results)
     print(f"  Synthesis: urgency={synthesis.get('urgency')}, revisit={synthesis.get('should_revisit')}")
 
-    # Step 4: Store results
-    conn = get_conn()
-    conn.autocommit = True
-    cur = conn.cursor()
+    # Step 4: Store results (psycopg2 is blocking, keep it off the event loop)
+    await asyncio.to_thread(store_research, rh_id, queries, synthesis, combined_results)
 
-    # Store insight
-    cur.execute(
-        """INSERT INTO insights (rabbit_hole_id, content, grounded, urgency)
-           VALUES (%s, %s, %s, %s)""",
-        (rh_id, synthesis.get("insight", ""), True, synthesis.get("urgency", "low")),
-    )
-
-    # Store research run
-    cur.execute(
-        """INSERT INTO research_runs (rabbit_hole_id, query_sent, deepseek_response, you_com_results)
-           VALUES (%s, %s, %s, %s)""",
-        (rh_id, json.dumps(queries), json.dumps(synthesis), combined_results[:10000]),
-    )
-
-    # Update rabbit hole
-    cur.execute(
-        """UPDATE rabbit_holes SET last_researched_at = NOW(), updated_at = NOW() WHERE id = %s""",
-        (rh_id,),
-    )
+    return synthesis
 
-    cur.close()
-    conn.close()
 
-    return synthesis
+def store_research(rh_id: int, queries: list[str], synthesis: dict, combined_results: str):
+    """Persist the insight and research run for a rabbit hole and mark it researched."""
+    # One round-trip: both inserts ride along as data-modifying CTEs of the UPDATE
+    with conn_ctx(autocommit=False) as conn, conn.cursor() as cur:
+        cur.execute(
+            """WITH ins AS (
+                   INSERT INTO insights (rabbit_hole_id, content, grounded, urgency)
+                   VALUES (%s, %s, %s, %s)
+                   RETURNING 1
+               ), run AS (
+                   INSERT INTO research_runs (rabbit_hole_id, query_sent, deepseek_response, you_com_results)
+                   VALUES (%s, %s, %s, %s)
+                   RETURNING 1
+               )
+               UPDATE rabbit_holes SET last_researched_at = NOW(), updated_at = NOW() WHERE id = %s""",
+            (
+                rh_id, synthesis.get("insight", ""), True, synthesis.get("urgency", "low"),
+                rh_id, orjson.dumps(queries).decode(), orjson.dumps(synthesis).decode(), combined_results[:10000],
+                rh_id,
+            ),
+        )
 
 
 def build_daily_plan():
@@ -109,41 +124,62 @@ def build_daily_plan():
 
     plan_text = generate_daily_plan(holes)
 
-    conn = get_conn()
-    conn.autocommit = True
-    cur = conn.cursor()
-    cur.execute(
+    execute(
         """INSERT INTO daily_plans (plan_date, plan_json)
            VALUES (%s, %s)
            ON CONFLICT (plan_date) DO UPDATE SET plan_json = EXCLUDED.plan_json, created_at = NOW()""",
         (date.today(), plan_text),
     )
-    cur.close()
-    conn.close()
 
     return plan_text
 
 
-def run_cycle(num_holes: int = 5):
-    """Run one full autonomous research cycle."""
+async def arun_cycle(num_holes: int = 5, max_concurrency: int = MAX_CONCURRENCY):
+    """Run one full autonomous research cycle, researching stale holes concurrently."""
     print(f"[{datetime.now(timezone.utc).isoformat()}] Starting research cycle...")
+    # Cached LLM/search results are never evicted on read; drop rows too old to be served
+    await asyncio.to_thread(purge_expired)
 
-    holes = get_stale_rabbit_holes(limit=num_holes)
+    holes = await asyncio.to_thread(get_stale_rabbit_holes, num_holes)
     if not holes:
         print("No active rabbit holes to research.")
         return
 
     print(f"Researching {len(holes)} rabbit holes...")
-    for rh in holes:
-        print(f"\n  Researching: {rh['name']} (priority: {rh['priority_score']})")
-        research_rabbit_hole(rh)
+    recent_map = await asyncio.to_thread(get_recent_insights, [rh["id"] for rh in holes])
+    sem = asyncio.Semaphore(max_concurrency)
+
+    async def sem_research(rh):
+        async with sem:
+            print(f"\n  Researching: {rh['name']} (priority: {rh['priority_score']})")
+            return await research_rabbit_hole(rh, recent_map.get(rh["id"], ""))
+
+    # One hole failing (e.g. an unparseable reply) must not abandon the others mid-write,
+    # so wait for all of them and still build the plan from whatever succeeded
+    results = await asyncio.gather(*(sem_research(rh) for rh in holes), return_exceptions=True)
+    for rh, result in zip(holes, results):
+        if isinstance(result, Exception):
+            print(f"  Research failed for {rh['name']}: {result!r}")
 
     print("\nGenerating daily plan...")
-    plan = build_daily_plan()
+    plan = await asyncio.to_thread(build_daily_plan)
     print(f"\nDaily plan generated:\n{plan[:500]}...")
 
     print(f"\n[{datetime.now(timezone.utc).isoformat()}] Research cycle complete.")
 
 
+def run_cycle(num_holes: int = 5):
+    """Run one full autonomous research cycle."""
+    asyncio.run(_run_cycle_and_close(num_holes))
+
+
+async def _run_cycle_and_close(num_holes: int):
+    # The shared async client is bound to this event loop, which asyncio.run() closes
+    try:
+        await arun_cycle(num_holes)
+    finally:
+        await clients.aclose()
+
+
 if __name__ == "__main__":
     run_cycle()
@@ -1,7 +1,13 @@
+import asyncio
+import io
 import os
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
 
 # Load from ~/.env (user's global env) then project .env
@@ -9,51 +15,162 @@ load_dotenv(Path.home() / ".env")
 load_dotenv(override=True)
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# ThreadedConnectionPool keeps at most minconn idle connections and closes any other returned
+# one, so anything below DB_POOL_MAX reopens a TLS connection on every concurrent borrow
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", str(DB_POOL_MAX)))
+# Pooled connections idle longer than this are pinged before reuse, in case the server dropped them
+DB_IDLE_CHECK_SECS = 60
+
+# TCP keepalives so NATs/load balancers don't silently drop connections idle between cycles
+CONNECT_KWARGS = {
+    "sslmode": "require",
+    "keepalives": 1,
+    "keepalives_idle": 60,
+    "keepalives_interval": 10,
+    "keepalives_count": 5,
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises when exhausted; make callers wait for a free connection instead
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+# id(conn) -> time.monotonic() when it was last returned to the pool
+_last_used: dict[int, float] = {}
 
 
 def get_conn():
-    return psycopg2.connect(DATABASE_URL, sslmode="require")
+    return psycopg2.connect(DATABASE_URL, **CONNECT_KWARGS)
+
+
+def get_pool() -> ThreadedConnectionPool:
+    """Lazily create the shared pool so importing db never touches the network."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL, **CONNECT_KWARGS)
+    return _pool
+
+
+def close_pool():
+    """Close every pooled connection (app shutdown)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def _checkout(pool: ThreadedConnectionPool):
+    """getconn(), replacing a connection that went dead while idle in the pool."""
+    while True:
+        conn = pool.getconn()
+        now = time.monotonic()
+        # Connections never handed out yet (e.g. opened when the pool was created) are checked too
+        if now - _last_used.pop(id(conn), 0.0) <= DB_IDLE_CHECK_SECS:
+            return conn
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return conn
+        except psycopg2.Error:
+            # Dead; close it and try the next idle one
+            pool.putconn(conn, close=True)
+
+
+@contextmanager
+def conn_ctx(autocommit=True):
+    """Borrow a pooled connection; commits (or rolls back) when autocommit is off."""
+    pool = get_pool()
+    _pool_slots.acquire()
+    try:
+        conn = _checkout(pool)
+        try:
+            conn.autocommit = autocommit
+            yield conn
+            if not autocommit:
+                conn.commit()
+        except Exception:
+            if not conn.closed and not autocommit:
+                conn.rollback()
+            raise
+        finally:
+            # Drop broken connections rather than handing them to the next caller
+            if not conn.closed:
+                _last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        _pool_slots.release()
 
 
 def execute(query, params=None, fetch=False):
-    conn = get_conn()
-    conn.autocommit = True
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute(query, params)
-    result = cur.fetchall() if fetch else None
-    cur.close()
-    conn.close()
-    return result
+    with conn_ctx() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, params)
+            return cur.fetchall() if fetch else None
+
+
+def execute_tuples(query, params=None):
+    """Like execute(fetch=True) but returns plain tuples; cheaper for large row counts."""
+    with conn_ctx() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall()
 
 
 def execute_one(query, params=None):
-    conn = get_conn()
-    conn.autocommit = True
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute(query, params)
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    return result
+    with conn_ctx() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, params)
+            return cur.fetchone()
+
+
+async def aexecute(query, params=None, fetch=False):
+    """execute() on a worker thread, so async routes don't block the event loop on the DB."""
+    return await asyncio.to_thread(execute, query, params, fetch)
+
+
+async def aexecute_one(query, params=None):
+    """execute_one() on a worker thread."""
+    return await asyncio.to_thread(execute_one, query, params)
 
 
 def execute_many(query, params_list):
-    conn = get_conn()
-    conn.autocommit = False
-    cur = conn.cursor()
-    cur.executemany(query, params_list)
-    conn.commit()
-    cur.close()
-    conn.close()
+    with conn_ctx(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            cur.executemany(query, params_list)
 
 
 def execute_batch(query, params_list, page_size=100):
     """Insert many rows efficiently using execute_values-style batching."""
-    conn = get_conn()
-    conn.autocommit = False
-    cur = conn.cursor()
     from psycopg2.extras import execute_batch as pg_execute_batch
-    pg_execute_batch(cur, query, params_list, page_size=page_size)
-    conn.commit()
-    cur.close()
-    conn.close()
+    with conn_ctx(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            pg_execute_batch(cur, query, params_list, page_size=page_size)
+
+
+# COPY text format escapes; None is written as \N (NULL)
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def copy_insert(table, columns, rows):
+    """Bulk insert rows via COPY into a temp staging table, then INSERT ... ON CONFLICT DO NOTHING.
+
+    COPY skips per-row INSERT parsing, but can't resolve conflicts itself, hence the staging table.
+    """
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(r"\N" if v is None else str(v).translate(_COPY_ESCAPES) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+
+    cols = ", ".join(columns)
+    with conn_ctx(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE TEMP TABLE {table}_stg (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+            cur.copy_expert(f"COPY {table}_stg ({cols}) FROM STDIN", buf)
+            cur.execute(
+                f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {table}_stg ON CONFLICT DO NOTHING"
+            )
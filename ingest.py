@@ -1,65 +1,100 @@
 """Ingest ChatGPT conversations.json into Postgres and extract rabbit holes."""
 
-import json
+import queue
 import re
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-
-from db import execute, execute_one, execute_batch, get_conn
-from services.akash import classify_conversations
-
-
-def parse_conversations(filepath: str) -> list[dict]:
-    """Parse conversations.json, flatten message trees, return structured data."""
-    with open(filepath) as f:
-        raw = json.load(f)
-
-    conversations = []
-    for conv in raw:
-        conv_id = conv.get("conversation_id") or conv.get("id", "")
-        title = conv.get("title") or "Untitled"
-        created_at = _ts_to_dt(conv.get("create_time"))
-        updated_at = _ts_to_dt(conv.get("update_time"))
-        model_slug = conv.get("default_model_slug")
-
-        # Flatten message tree
-        messages = []
-        mapping = conv.get("mapping", {})
-        for node_id, node in mapping.items():
-            msg = node.get("message")
-            if not msg:
-                continue
-            role = msg.get("author", {}).get("role")
-            if role not in ("user", "assistant"):
-                continue
-            content = msg.get("content", {})
-            parts = content.get("parts", [])
-            text_parts = [p for p in parts if isinstance(p, str) and p.strip()]
-            if not text_parts:
-                continue
-            text = "\n".join(text_parts)
-            msg_created = _ts_to_dt(msg.get("create_time"))
-            messages.append({
-                "id": node_id,
-                "role": role,
-                "content": text,
-                "created_at": msg_created,
-            })
-
-        # Sort messages by created_at (None last)
-        messages.sort(key=lambda m: m["created_at"] or datetime.min.replace(tzinfo=timezone.utc))
-
-        conversations.append({
-            "id": conv_id,
-            "title": title,
-            "created_at": created_at,
-            "updated_at": updated_at,
-            "model_slug": model_slug,
-            "messages": messages,
-            "message_count": len(messages),
-        })
-
-    return conversations
+from itertools import chain, islice
+from operator import itemgetter
+
+import ijson
+from psycopg2.extras import execute_values as pg_execute_values
+
+from db import copy_insert, conn_ctx
+from llm_cache import cached_llm
+from services.akash import AKASH_USE_BATCH, classify_conversations
+from services.akash_batch import classify_conversations_batched
+
+# Classification batches in flight at once (each is a blocking DeepSeek call)
+CLASSIFY_WORKERS = 6
+# Conversations per classification prompt, to stay within context limits
+CLASSIFY_BATCH_SIZE = 30
+# Classifications are stable for identical input, so re-ingesting an export reuses them for a month
+CLASSIFY_CACHE_TTL = 30 * 24 * 3600
+# Conversations parsed per chunk handed to the insert/classify stages in run()
+CHUNK_SIZE = 500
+
+# Message rows are insert-ready tuples: (id, conversation_id, role, content, created_at)
+_by_created_at = itemgetter(4)
+
+_AND_RE = re.compile(r"\s+and\s+")
+_WS_RE = re.compile(r"\s+")
+
+
+def iter_conversations(filepath: str):
+    """Stream conversations.json one conversation at a time, yielding flattened conversations."""
+    with open(filepath, "rb") as f:
+        for conv in ijson.items(f, "item", use_float=True):
+            yield _build_conv(conv)
+
+
+def _build_conv(conv: dict) -> dict:
+    """Flatten one raw export conversation (message tree) into our structured form."""
+    conv_id = conv.get("conversation_id") or conv.get("id", "")
+    title = conv.get("title") or "Untitled"
+    created_at = _ts_to_dt(conv.get("create_time"))
+    updated_at = _ts_to_dt(conv.get("update_time"))
+    model_slug = conv.get("default_model_slug")
+
+    # Flatten message tree. This runs once per message on exports with millions of them,
+    # so bind hot lookups locally and bail out before building anything for skipped nodes.
+    # Untimestamped messages go first, in tree order; the rest are sorted by created_at.
+    untimed = []
+    timed = []
+    ts_to_dt = _ts_to_dt
+    mapping = conv.get("mapping") or {}
+    for node_id, node in mapping.items():
+        msg = node.get("message")
+        if not msg:
+            continue
+        author = msg.get("author")
+        role = author.get("role") if author else None
+        if role != "user" and role != "assistant":
+            continue
+        content = msg.get("content")
+        parts = content.get("parts") if content else None
+        if not parts:
+            continue
+        # Same as isinstance(p, str) and p.strip(), without allocating a stripped copy
+        text_parts = [p for p in parts if type(p) is str and p and not p.isspace()]
+        if not text_parts:
+            continue
+        created = ts_to_dt(msg.get("create_time"))
+        (untimed if created is None else timed).append((
+            node_id,
+            conv_id,
+            role,
+            text_parts[0] if len(text_parts) == 1 else "\n".join(text_parts),
+            created,
+        ))
+
+    timed.sort(key=_by_created_at)
+    messages = untimed + timed
+    # Opening of the conversation as shown to the classifier; built once here rather than per summary
+    summary_head = " | ".join(f"[{role}]: {content[:150]}" for _, _, role, content, _ in messages[:3])
+
+    return {
+        "id": conv_id,
+        "title": title,
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "model_slug": model_slug,
+        "messages": messages,
+        "message_count": len(messages),
+        "summary_head": summary_head,
+    }
 
 
 def _ts_to_dt(ts):
@@ -68,132 +103,242 @@ def _ts_to_dt(ts):
     return datetime.fromtimestamp(ts, tz=timezone.utc)
 
 
-def insert_conversations(conversations: list[dict]):
-    """Insert conversations and messages into Postgres."""
-    conv_params = [
+def _chunked(iterable, size: int):
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def _insert_chunk(conversations: list[dict]) -> int:
+    conv_rows = [
         (c["id"], c["title"], c["created_at"], c["updated_at"], c["message_count"], c["model_slug"])
         for c in conversations
     ]
-    execute_batch(
-        """INSERT INTO conversations (id, title, created_at, updated_at, message_count, model_slug)
-           VALUES (%s, %s, %s, %s, %s, %s)
-           ON CONFLICT (id) DO NOTHING""",
-        conv_params,
+    copy_insert(
+        "conversations",
+        ("id", "title", "created_at", "updated_at", "message_count", "model_slug"),
+        conv_rows,
     )
-    print(f"Inserted {len(conv_params)} conversations.")
 
-    msg_params = []
-    for c in conversations:
-        for m in c["messages"]:
-            msg_params.append((m["id"], c["id"], m["role"], m["content"], m["created_at"]))
-
-    execute_batch(
-        """INSERT INTO messages (id, conversation_id, role, content, created_at)
-           VALUES (%s, %s, %s, %s, %s)
-           ON CONFLICT (id) DO NOTHING""",
-        msg_params,
+    copy_insert(
+        "messages",
+        ("id", "conversation_id", "role", "content", "created_at"),
+        chain.from_iterable(c["messages"] for c in conversations),
     )
-    print(f"Inserted {len(msg_params)} messages.")
+    return sum(c["message_count"] for c in conversations)
 
 
-def extract_rabbit_holes(conversations: list[dict]):
-    """Use DeepSeek to classify conversations into rabbit holes."""
-    # Filter out trivial conversations (< 4 messages)
-    substantive = [c for c in conversations if c["message_count"] >= 4]
-    print(f"Classifying {len(substantive)} substantive conversations into rabbit holes...")
+def _normalize_rh_name(name: str) -> str:
+    """Dedup key for rabbit holes: case-insensitive, " and " vs " & " and whitespace normalized.
 
-    # Build summaries for DeepSeek
+    Stored in rabbit_holes.normalized_name; keep in sync with the backfill in models.MIGRATE_SQL.
+    """
+    s = (name or "").lower().strip()
+    if "and" in s:
+        s = _AND_RE.sub(" & ", s)
+    return _WS_RE.sub(" ", s)
+
+
+def _summarize(conversations: list[dict]) -> list[dict]:
+    """Build DeepSeek summaries for substantive conversations (trivial ones, < 4 messages, are skipped)."""
     summaries = []
-    for c in substantive:
-        first_msgs = " | ".join(
-            f"[{m['role']}]: {m['content'][:150]}"
-            for m in c["messages"][:3]
-        )
+    for c in conversations:
+        if c["message_count"] < 4:
+            continue
         summaries.append({
             "id": c["id"],
             "title": c["title"],
             "message_count": c["message_count"],
-            "first_messages": first_msgs,
+            "first_messages": c["summary_head"],
             "created_at": str(c["created_at"]),
         })
+    return summaries
+
 
-    # Process in batches of 30 to stay within context limits
-    batch_size = 30
+def _classify_batch(batch: list[dict]) -> list[dict]:
+    return cached_llm(classify_conversations, batch, ttl=CLASSIFY_CACHE_TTL)
+
+
+def _collect_holes(batches: list[list[dict]], futures: list) -> list[dict]:
+    """Gather classification futures in submission order, so merging stays deterministic."""
     all_holes = []
-    for i in range(0, len(summaries), batch_size):
-        batch = summaries[i : i + batch_size]
-        print(f"  Batch {i // batch_size + 1}: classifying {len(batch)} conversations...")
-        holes = classify_conversations(batch)
+    for n, (batch, future) in enumerate(zip(batches, futures), 1):
+        holes = future.result()
+        print(f"  Batch {n}: classified {len(batch)} conversations into {len(holes)} rabbit holes.")
         all_holes.extend(holes)
+    return all_holes
 
-    # Merge rabbit holes with the same name (case-insensitive, " and " vs " & " normalized)
-    def norm_name(s):
-        s = (s or "").lower().strip()
-        s = re.sub(r"\s+and\s+", " & ", s)
-        s = re.sub(r"\s+", " ", s)
-        return s
 
+def store_rabbit_holes(all_holes: list[dict]):
+    """Merge classified rabbit holes, upsert them with their conversation links, then score them."""
+    # Merge rabbit holes with the same normalized name: the first one's name and description
+    # win, and their conversation IDs are unioned
     merged = {}
+    conv_ids = {}
     for rh in all_holes:
-        key = norm_name(rh["name"])
-        if key in merged:
-            merged[key]["conversation_ids"].extend(rh.get("conversation_ids", []))
-            merged[key]["conversation_ids"] = list(set(merged[key]["conversation_ids"]))
-        else:
-            merged[key] = rh
-
-    # Insert rabbit holes and link conversations
-    conn = get_conn()
-    conn.autocommit = True
-    cur = conn.cursor()
-
-    for rh in merged.values():
-        conv_ids = rh.get("conversation_ids", [])
-        # Compute priority: more conversations + more messages = higher priority
-        conv_data = [c for c in conversations if c["id"] in conv_ids]
-        total_msgs = sum(c["message_count"] for c in conv_data)
-        recency_bonus = 0
-        if conv_data:
-            latest = max((c["updated_at"] or c["created_at"] or datetime.min.replace(tzinfo=timezone.utc)) for c in conv_data)
-            days_ago = (datetime.now(timezone.utc) - latest).days
-            recency_bonus = max(0, 10 - days_ago * 0.1)
-        priority = len(conv_ids) * 2 + total_msgs * 0.1 + recency_bonus
+        key = _normalize_rh_name(rh["name"])
+        merged.setdefault(key, rh)
+        conv_ids.setdefault(key, set()).update(rh.get("conversation_ids", []))
+
+    rh_params = [(rh["name"], key, rh.get("description", "")) for key, rh in merged.items()]
+
+    # Upsert rabbit holes and link conversations, one multi-row statement each. A hole that
+    # already exists (same normalized name, e.g. from an earlier ingest) is reused, not duplicated.
+    # One transaction, so a failure never leaves holes without their links or scores.
+    with conn_ctx(autocommit=False) as conn, conn.cursor() as cur:
+        rows = pg_execute_values(
+            cur,
+            """INSERT INTO rabbit_holes (name, normalized_name, description)
+               VALUES %s
+               ON CONFLICT (normalized_name) DO UPDATE SET
+                   description = EXCLUDED.description,
+                   updated_at = NOW()
+               RETURNING id, normalized_name""",
+            rh_params,
+            page_size=1000,
+            fetch=True,
+        )
+        existing_by_norm = {norm: rh_id for rh_id, norm in rows}
+
+        links = [
+            (existing_by_norm[key], str(cid))
+            for key, cids in conv_ids.items()
+            for cid in cids
+        ]
+        # Only link conversations that actually exist (DeepSeek may hallucinate IDs)
+        pg_execute_values(
+            cur,
+            """INSERT INTO rabbit_hole_conversations (rabbit_hole_id, conversation_id)
+               SELECT v.rh, v.cid FROM (VALUES %s) AS v(rh, cid)
+               JOIN conversations c ON c.id = v.cid
+               ON CONFLICT DO NOTHING""",
+            links,
+            page_size=5000,
+        )
 
+        # Priority: more conversations + more messages = higher, plus a bonus for recent activity
         cur.execute(
-            """INSERT INTO rabbit_holes (name, description, priority_score)
-               VALUES (%s, %s, %s) RETURNING id""",
-            (rh["name"], rh.get("description", ""), round(priority, 2)),
+            """UPDATE rabbit_holes rh
+               SET priority_score = GREATEST(rh.priority_score, s.score)
+               FROM (
+                   SELECT rhc.rabbit_hole_id AS id,
+                          ROUND((COUNT(*) * 2 + SUM(c.message_count) * 0.1 + GREATEST(0,
+                              10 - EXTRACT(DAY FROM NOW() - MAX(COALESCE(c.updated_at, c.created_at))) * 0.1
+                          ))::numeric, 2) AS score
+                   FROM rabbit_hole_conversations rhc
+                   JOIN conversations c ON c.id = rhc.conversation_id
+                   WHERE rhc.rabbit_hole_id = ANY(%s)
+                   GROUP BY rhc.rabbit_hole_id
+               ) s
+               WHERE rh.id = s.id""",
+            (list(existing_by_norm.values()),),
         )
-        rh_id = cur.fetchone()[0]
 
-        for cid in conv_ids:
-            # Only link if conversation actually exists (DeepSeek may hallucinate IDs)
-            cur.execute(
-                """INSERT INTO rabbit_hole_conversations (rabbit_hole_id, conversation_id)
-                   SELECT %s, %s WHERE EXISTS (SELECT 1 FROM conversations WHERE id = %s)
-                   ON CONFLICT DO NOTHING""",
-                (rh_id, cid, cid),
-            )
-
-    cur.close()
-    conn.close()
-    print(f"Created {len(merged)} rabbit holes.")
+    print(f"Created or updated {len(merged)} rabbit holes.")
 
 
 def run(filepath: str):
-    print(f"Parsing {filepath}...")
-    conversations = parse_conversations(filepath)
-    print(f"Found {len(conversations)} conversations with {sum(c['message_count'] for c in conversations)} total messages.")
-
-    print("Inserting into database...")
-    insert_conversations(conversations)
+    """Ingest an export as a pipeline so parsing, DB inserts and classification overlap.
+
+    The main thread streams the file in chunks. An inserter thread writes each chunk,
+    and a classifier thread hands every full batch of summaries to DeepSeek right away.
+    The first error in any stage stops the others, so no more of the export is parsed
+    or sent to DeepSeek.
+    """
+    print(f"Parsing {filepath}; inserting and classifying as chunks arrive...")
+    insert_q = queue.Queue(maxsize=4)
+    classify_q = queue.Queue(maxsize=4)
+    stop = threading.Event()
+    # Parsed chunks are not retained; each chunk's messages are freed once it is inserted
+    num_convs = num_msgs = 0
+    pending = []
+    batches = []
+    futures = []
+
+    def cancel_pending():
+        # Only batches not yet started; the pool runs them in order, so every cancelled
+        # future comes after any that failed
+        for future in list(futures):
+            future.cancel()
+
+    def stop_on_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            stop.set()
+            cancel_pending()
+
+    with ThreadPoolExecutor(max_workers=CLASSIFY_WORKERS) as classify_pool, \
+            ThreadPoolExecutor(max_workers=2) as stages:
+
+        def queue_batches(summaries, flush=False):
+            pending.extend(summaries)
+            while len(pending) >= CLASSIFY_BATCH_SIZE or (flush and pending):
+                batch = pending[:CLASSIFY_BATCH_SIZE]
+                del pending[:CLASSIFY_BATCH_SIZE]
+                batches.append(batch)
+                if not AKASH_USE_BATCH and not stop.is_set():
+                    future = classify_pool.submit(_classify_batch, batch)
+                    futures.append(future)
+                    future.add_done_callback(stop_on_error)
+
+        inserter = stages.submit(_drain, insert_q, _insert_chunk, stop)
+        classifier = stages.submit(_drain, classify_q, queue_batches, stop)
+        try:
+            for chunk in _chunked(iter_conversations(filepath), CHUNK_SIZE):
+                if stop.is_set():
+                    break
+                num_convs += len(chunk)
+                num_msgs += sum(c["message_count"] for c in chunk)
+                insert_q.put(chunk)
+                classify_q.put(_summarize(chunk))
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            insert_q.put(None)
+            classify_q.put(None)
+            # Waits for both stages, so no batch is submitted after this
+            errors = [stage.result() for stage in (inserter, classifier)]
+            if stop.is_set():
+                cancel_pending()
+        for error in errors:
+            if error is not None:
+                raise error
+        if stop.is_set():
+            # A classification batch failed; result() re-raises its error
+            for future in futures:
+                future.result()
+        queue_batches([], flush=True)
+
+        print(f"Inserted {num_convs} conversations with {num_msgs} total messages.")
+        print(f"Classifying {sum(len(b) for b in batches)} substantive conversations into rabbit holes...")
+        if AKASH_USE_BATCH:
+            all_holes = classify_conversations_batched(batches)
+        else:
+            all_holes = _collect_holes(batches, futures)
 
-    print("Extracting rabbit holes via DeepSeek...")
-    extract_rabbit_holes(conversations)
+    store_rabbit_holes(all_holes)
 
     print("Ingestion complete.")
 
 
+def _drain(q: queue.Queue, handle, stop: threading.Event):
+    """Consume a pipeline queue until its None sentinel; returns the first error raised by handle.
+
+    A failure sets stop. Once stop is set, items are skipped, but the queue keeps being
+    drained so the producer never blocks on a full queue.
+    """
+    error = None
+    while (item := q.get()) is not None:
+        if stop.is_set():
+            continue
+        try:
+            handle(item)
+        except Exception as e:
+            error = e
+            stop.set()
+    return error
+
+
 if __name__ == "__main__":
     path = sys.argv[1] if len(sys.argv) > 1 else "/Users/kian/Downloads/hackathon/conversations.json"
     run(path)
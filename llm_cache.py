@@ -0,0 +1,67 @@
+"""Postgres-backed cache for LLM (and search) calls, keyed by a hash of the function name, model, prompts and arguments."""
+
+import asyncio
+import hashlib
+
+import orjson
+
+from db import execute, execute_one
+from services.akash import AKASH_MODEL, PROMPT_VERSION
+
+DEFAULT_TTL = 24 * 3600  # seconds
+# Longest ttl any caller uses (ingest.CLASSIFY_CACHE_TTL); older rows can never be served
+MAX_TTL = 30 * 24 * 3600
+
+
+def _cache_key(fn, args) -> str:
+    # The model and prompt templates are part of the key, so changing either invalidates old answers
+    payload = orjson.dumps(
+        [fn.__name__, AKASH_MODEL, PROMPT_VERSION, args], default=str, option=orjson.OPT_SORT_KEYS
+    )
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _cache_get(key: str, ttl: int):
+    return execute_one(
+        """SELECT value FROM llm_cache
+           WHERE key = %s AND created_at > NOW() - make_interval(secs => %s)""",
+        (key, ttl),
+    )
+
+
+def _cache_put(key: str, value):
+    execute(
+        """INSERT INTO llm_cache (key, value) VALUES (%s, %s)
+           ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, created_at = NOW()""",
+        (key, orjson.dumps(value).decode()),
+    )
+
+
+def purge_expired(max_age: int = MAX_TTL):
+    """Delete cached results older than max_age seconds."""
+    execute(
+        "DELETE FROM llm_cache WHERE created_at < NOW() - make_interval(secs => %s)",
+        (max_age,),
+    )
+
+
+def cached_llm(fn, *args, ttl: int = DEFAULT_TTL):
+    """Return fn(*args), reusing a stored result for identical inputs younger than ttl seconds."""
+    key = _cache_key(fn, args)
+    row = _cache_get(key, ttl)
+    if row:
+        return row["value"]
+    value = fn(*args)
+    _cache_put(key, value)
+    return value
+
+
+async def acached_llm(fn, *args, ttl: int = DEFAULT_TTL):
+    """Async variant of cached_llm() for coroutine functions."""
+    key = _cache_key(fn, args)
+    row = await asyncio.to_thread(_cache_get, key, ttl)
+    if row:
+        return row["value"]
+    value = await fn(*args)
+    await asyncio.to_thread(_cache_put, key, value)
+    return value
@@ -1,169 +1,183 @@
 """FastAPI dashboard for RabbitHole."""
 
 import os
-import json
+import time
+import asyncio
+import hashlib
+from functools import lru_cache
 from datetime import datetime, timezone, date
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.templating import Jinja2Templates
-from apscheduler.schedulers.background import BackgroundScheduler
+from jinja2 import FileSystemBytecodeCache
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from pathlib import Path
 from dotenv import load_dotenv
+import orjson
 
 load_dotenv(Path.home() / ".env")
 load_dotenv(override=True)
 
-from db import execute, execute_one
-from agent import run_cycle
+from db import aexecute, aexecute_one, close_pool, get_pool
+from agent import arun_cycle
 from models import apply_schema
+from services import clients
 
 
-scheduler = BackgroundScheduler()
+# Jobs run as coroutines on the app's event loop, not in a scheduler thread
+scheduler = AsyncIOScheduler()
 AGENT_STATUS = {"last_run": None, "running": False, "runs_completed": 0, "error": None}
 
+# Read-mostly query results, keyed by route; cleared whenever a research cycle finishes
+CACHE_TTL = 60  # seconds
+QUERY_CACHE: dict[str, tuple[float, object]] = {}
+
+
+async def cached_query(key: str, compute):
+    """Return await compute()'s result, reusing it for CACHE_TTL seconds."""
+    now = time.monotonic()
+    hit = QUERY_CACHE.get(key)
+    if hit and hit[0] > now:
+        return hit[1]
+    value = await compute()
+    QUERY_CACHE[key] = (now + CACHE_TTL, value)
+    return value
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: apply schema + start scheduler
+    # Startup: open the DB pool, apply schema, compile templates + start scheduler
+    get_pool()
     apply_schema()
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.env.get_template(name)
     scheduler.add_job(scheduled_research, "interval", hours=6, id="research_cycle")
     scheduler.start()
     yield
     # Shutdown
     scheduler.shutdown()
+    await clients.aclose()
+    clients.close()
+    close_pool()
 
 
-app = FastAPI(title="RabbitHole", lifespan=lifespan)
+app = FastAPI(title="RabbitHole", lifespan=lifespan, default_response_class=ORJSONResponse)
 templates = Jinja2Templates(directory="templates")
+# Templates only change on deploy: skip per-render mtime checks and share compiled bytecode across workers
+os.makedirs(".jinja-cache", exist_ok=True)
+templates.env.bytecode_cache = FileSystemBytecodeCache(".jinja-cache")
+templates.env.auto_reload = False
 
 import markdown as md
 
+# md.markdown() builds a new parser (and loads its extensions) per call; reuse one instead.
+# Filters run on the event loop thread, so a shared instance is safe.
+_markdown = md.Markdown(extensions=["extra"])
+
+
+# The daily plan is the same text on every dashboard view; only re-render when it changes
+@lru_cache(maxsize=1024)
 def render_markdown(text: str) -> str:
-    return md.markdown(text or "", extensions=["extra"])
+    return _markdown.reset().convert(text or "")
 
 templates.env.filters["markdown"] = render_markdown
 
 
-def _normalize_hole_name(name: str) -> str:
-    """Normalize for deduping: 'X and Y' vs 'X & Y' etc."""
-    import re
-    s = (name or "").lower().strip()
-    s = re.sub(r"\s+and\s+", " & ", s)
-    s = re.sub(r"\s+", " ", s)
-    return s
-
-
-def _dedupe_rabbit_holes(holes: list) -> list:
-    """Collapse rows with same normalized name; keep highest priority, sum counts."""
-    by_key = {}
-    for h in holes or []:
-        key = _normalize_hole_name(h.get("name") or "")
-        if not key:
-            continue
-        if key not in by_key:
-            by_key[key] = dict(h)
-            by_key[key]["conv_count"] = int(h.get("conv_count") or 0)
-            by_key[key]["insight_count"] = int(h.get("insight_count") or 0)
-        else:
-            by_key[key]["conv_count"] += int(h.get("conv_count") or 0)
-            by_key[key]["insight_count"] += int(h.get("insight_count") or 0)
-            if (h.get("priority_score") or 0) > (by_key[key].get("priority_score") or 0):
-                by_key[key]["id"] = h["id"]
-                by_key[key]["name"] = h["name"]
-                by_key[key]["description"] = h.get("description")
-                by_key[key]["priority_score"] = h.get("priority_score")
-                by_key[key]["last_researched_at"] = h.get("last_researched_at")
-                by_key[key]["status"] = h.get("status")
-                if "created_at" in h:
-                    by_key[key]["created_at"] = h["created_at"]
-    return list(by_key.values())
-
-
-def scheduled_research():
+async def scheduled_research():
     """Background scheduled research cycle."""
     AGENT_STATUS["running"] = True
     AGENT_STATUS["error"] = None
     AGENT_STATUS["last_run"] = datetime.now(timezone.utc).isoformat()
     try:
-        run_cycle(num_holes=5)
+        await arun_cycle(num_holes=5)
         AGENT_STATUS["runs_completed"] += 1
     except Exception as e:
         AGENT_STATUS["error"] = str(e)
     finally:
         AGENT_STATUS["running"] = False
+        QUERY_CACHE.clear()
 
 
 # --- Dashboard Routes ---
 
+# Per-hole conversation/insight counts, aggregated once per table instead of a subquery per row
+HOLE_COUNTS_CTE = """
+    WITH cc AS (SELECT rabbit_hole_id, COUNT(*) as n FROM rabbit_hole_conversations GROUP BY rabbit_hole_id),
+         ic AS (SELECT rabbit_hole_id, COUNT(*) as n FROM insights GROUP BY rabbit_hole_id)"""
+
 
 @app.get("/", response_class=HTMLResponse)
 async def dashboard(request: Request):
-    # Today's plan
-    plan = execute_one(
-        "SELECT plan_json, created_at FROM daily_plans WHERE plan_date = %s",
-        (date.today(),),
-    )
+    data = await cached_query("dashboard", _dashboard_data)
+    return templates.TemplateResponse("dashboard.html", {
+        "request": request,
+        **data,
+        "agent_status": AGENT_STATUS,
+    })
 
-    # Top rabbit holes (fetch extra then dedupe by normalized name so we get ~20 unique)
-    raw_holes = execute(
-        """SELECT rh.id, rh.name, rh.description, rh.priority_score, rh.last_researched_at, rh.status,
-                  COUNT(DISTINCT rhc.conversation_id) as conv_count,
-                  (SELECT COUNT(*) FROM insights WHERE rabbit_hole_id = rh.id) as insight_count
-           FROM rabbit_holes rh
-           LEFT JOIN rabbit_hole_conversations rhc ON rh.id = rhc.rabbit_hole_id
-           WHERE rh.status = 'active'
-           GROUP BY rh.id
-           ORDER BY rh.priority_score DESC
-           LIMIT 60""",
-        fetch=True,
-    )
-    holes = sorted(_dedupe_rabbit_holes(raw_holes), key=lambda h: (h.get("priority_score") or 0), reverse=True)[:20]
-
-    # Recent insights
-    recent_insights = execute(
-        """SELECT i.content, i.urgency, i.created_at, rh.name as rabbit_hole_name
-           FROM insights i
-           JOIN rabbit_holes rh ON i.rabbit_hole_id = rh.id
-           ORDER BY i.created_at DESC LIMIT 10""",
-        fetch=True,
-    )
 
-    # Stats
-    stats = execute_one(
-        """SELECT
-            (SELECT COUNT(*) FROM conversations) as total_conversations,
-            (SELECT COUNT(*) FROM messages) as total_messages,
-            (SELECT COUNT(*) FROM rabbit_holes WHERE status = 'active') as active_holes,
-            (SELECT COUNT(*) FROM insights) as total_insights,
-            (SELECT COUNT(*) FROM research_runs) as total_runs"""
+async def _dashboard_data() -> dict:
+    # Independent queries, so run them concurrently on separate pooled connections
+    plan, holes, recent_insights, stats = await asyncio.gather(
+        # Today's plan
+        aexecute_one(
+            "SELECT plan_json, created_at FROM daily_plans WHERE plan_date = %s",
+            (date.today(),),
+        ),
+        # Top rabbit holes (names are unique per rabbit_holes.normalized_name, so no dedupe needed)
+        aexecute(
+            HOLE_COUNTS_CTE + """
+               SELECT rh.id, rh.name, rh.description, rh.priority_score, rh.last_researched_at, rh.status,
+                      COALESCE(cc.n, 0) as conv_count, COALESCE(ic.n, 0) as insight_count
+               FROM rabbit_holes rh
+               LEFT JOIN cc ON cc.rabbit_hole_id = rh.id
+               LEFT JOIN ic ON ic.rabbit_hole_id = rh.id
+               WHERE rh.status = 'active'
+               ORDER BY rh.priority_score DESC
+               LIMIT 20""",
+            fetch=True,
+        ),
+        # Recent insights
+        aexecute(
+            """SELECT i.content, i.urgency, i.created_at, rh.name as rabbit_hole_name
+               FROM insights i
+               JOIN rabbit_holes rh ON i.rabbit_hole_id = rh.id
+               ORDER BY i.created_at DESC LIMIT 10""",
+            fetch=True,
+        ),
+        # Stats
+        aexecute_one(
+            """SELECT
+                (SELECT COUNT(*) FROM conversations) as total_conversations,
+                (SELECT COUNT(*) FROM rabbit_holes WHERE status = 'active') as active_holes,
+                (SELECT COUNT(*) FROM insights) as total_insights,
+                (SELECT COUNT(*) FROM research_runs) as total_runs"""
+        ),
     )
 
-    return templates.TemplateResponse("dashboard.html", {
-        "request": request,
+    return {
         "plan": plan,
         "holes": holes or [],
         "recent_insights": recent_insights or [],
         "stats": stats or {},
-        "agent_status": AGENT_STATUS,
-    })
+    }
 
 
 @app.get("/rabbit-holes", response_class=HTMLResponse)
 async def list_rabbit_holes(request: Request):
-    raw_holes = execute(
-        """SELECT rh.id, rh.name, rh.description, rh.priority_score,
+    holes = await aexecute(
+        HOLE_COUNTS_CTE + """
+           SELECT rh.id, rh.name, rh.description, rh.priority_score,
                   rh.last_researched_at, rh.status, rh.created_at,
-                  COUNT(DISTINCT rhc.conversation_id) as conv_count,
-                  (SELECT COUNT(*) FROM insights WHERE rabbit_hole_id = rh.id) as insight_count
+                  COALESCE(cc.n, 0) as conv_count, COALESCE(ic.n, 0) as insight_count
            FROM rabbit_holes rh
-           LEFT JOIN rabbit_hole_conversations rhc ON rh.id = rhc.rabbit_hole_id
-           GROUP BY rh.id
+           LEFT JOIN cc ON cc.rabbit_hole_id = rh.id
+           LEFT JOIN ic ON ic.rabbit_hole_id = rh.id
            ORDER BY rh.priority_score DESC""",
         fetch=True,
     )
-    holes = sorted(_dedupe_rabbit_holes(raw_holes), key=lambda h: (h.get("priority_score") or 0), reverse=True)
     return templates.TemplateResponse("rabbit_holes.html", {
         "request": request,
         "holes": holes or [],
@@ -172,29 +186,28 @@ async def list_rabbit_holes(request: Request):
 
 @app.get("/rabbit-holes/{hole_id}", response_class=HTMLResponse)
 async def rabbit_hole_detail(request: Request, hole_id: int):
-    hole = execute_one("SELECT * FROM rabbit_holes WHERE id = %s", (hole_id,))
-
-    conversations = execute(
-        """SELECT c.id, c.title, c.created_at, c.message_count
-           FROM conversations c
-           JOIN rabbit_hole_conversations rhc ON c.id = rhc.conversation_id
-           WHERE rhc.rabbit_hole_id = %s
-           ORDER BY c.created_at DESC""",
-        (hole_id,),
-        fetch=True,
-    )
-
-    insights = execute(
-        """SELECT * FROM insights WHERE rabbit_hole_id = %s ORDER BY created_at DESC""",
-        (hole_id,),
-        fetch=True,
-    )
-
-    runs = execute(
-        """SELECT id, query_sent, created_at FROM research_runs
-           WHERE rabbit_hole_id = %s ORDER BY created_at DESC LIMIT 10""",
-        (hole_id,),
-        fetch=True,
+    hole, conversations, insights, runs = await asyncio.gather(
+        aexecute_one("SELECT * FROM rabbit_holes WHERE id = %s", (hole_id,)),
+        aexecute(
+            """SELECT c.id, c.title, c.created_at, c.message_count
+               FROM conversations c
+               JOIN rabbit_hole_conversations rhc ON c.id = rhc.conversation_id
+               WHERE rhc.rabbit_hole_id = %s
+               ORDER BY c.created_at DESC""",
+            (hole_id,),
+            fetch=True,
+        ),
+        aexecute(
+            """SELECT * FROM insights WHERE rabbit_hole_id = %s ORDER BY created_at DESC""",
+            (hole_id,),
+            fetch=True,
+        ),
+        aexecute(
+            """SELECT id, query_sent, created_at FROM research_runs
+               WHERE rabbit_hole_id = %s ORDER BY created_at DESC LIMIT 10""",
+            (hole_id,),
+            fetch=True,
+        ),
     )
 
     return templates.TemplateResponse("rabbit_hole.html", {
@@ -209,35 +222,84 @@ async def rabbit_hole_detail(request: Request, hole_id: int):
 @app.post("/agent/run")
 async def trigger_agent(background_tasks: BackgroundTasks):
     if AGENT_STATUS["running"]:
-        return JSONResponse({"status": "already_running"})
+        return ORJSONResponse({"status": "already_running"})
     background_tasks.add_task(scheduled_research)
-    return JSONResponse({"status": "started"})
+    return ORJSONResponse({"status": "started"})
 
 
 @app.get("/agent/status")
-async def agent_status():
-    return JSONResponse(AGENT_STATUS)
+async def agent_status(request: Request):
+    # Polled by the dashboard, but only changes when a cycle starts or ends; clients
+    # revalidate every time ("no-cache") and mostly get an empty 304
+    body = orjson.dumps(AGENT_STATUS)
+    etag = f'W/"{hashlib.md5(body).hexdigest()}"'
+    if (not_modified := _not_modified(request, etag, "no-cache")) is not None:
+        return not_modified
+    return Response(body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 
-@app.get("/api/rabbit-holes")
-async def api_rabbit_holes():
-    holes = execute(
+# --- JSON API ---
+
+# Clients may reuse a response for a minute, then revalidate with If-None-Match
+API_CACHE_CONTROL = "max-age=60, stale-while-revalidate=600"
+
+
+def _etag(version: dict) -> str:
+    """Weak ETag from a (row count, newest change) pair, so inserts, updates and deletes all change it."""
+    return f'W/"{version["n"]}-{version["v"]}"'
+
+
+def _not_modified(request: Request, etag: str, cache_control: str = API_CACHE_CONTROL):
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+
+async def _api_rabbit_holes_data():
+    # Every write to a hole (upsert, scoring, research) bumps updated_at
+    # Version first, then rows: if a write lands in between, the ETag is older than the
+    # body (one extra 200 later), never newer (a stale body kept by 304s)
+    version = await aexecute_one(
+        """SELECT COUNT(*) as n, COALESCE(EXTRACT(EPOCH FROM MAX(updated_at)), 0) as v
+           FROM rabbit_holes WHERE status = 'active'"""
+    )
+    holes = await aexecute(
         """SELECT rh.id, rh.name, rh.description, rh.priority_score,
                   rh.last_researched_at, rh.status
            FROM rabbit_holes rh WHERE rh.status = 'active'
            ORDER BY rh.priority_score DESC""",
         fetch=True,
     )
-    return JSONResponse([dict(r) for r in (holes or [])], default=str)
+    return _etag(version), holes
+
+
+@app.get("/api/rabbit-holes")
+async def api_rabbit_holes(request: Request):
+    # ETag and rows are cached together so a cached body is never labelled with a newer ETag
+    etag, holes = await cached_query("api_rabbit_holes", _api_rabbit_holes_data)
+    if (not_modified := _not_modified(request, etag)) is not None:
+        return not_modified
+    # RealDictRows and datetimes serialize natively with orjson
+    return ORJSONResponse(
+        holes or [],
+        headers={"ETag": etag, "Cache-Control": API_CACHE_CONTROL},
+    )
 
 
 @app.get("/api/insights")
-async def api_insights(limit: int = 20):
-    insights = execute(
+async def api_insights(request: Request, limit: int = 20):
+    # Insights are insert-only, so count + newest id identifies the current set
+    etag = _etag(await aexecute_one("SELECT COUNT(*) as n, COALESCE(MAX(id), 0) as v FROM insights"))
+    if (not_modified := _not_modified(request, etag)) is not None:
+        return not_modified
+    insights = await aexecute(
         """SELECT i.*, rh.name as rabbit_hole_name
            FROM insights i JOIN rabbit_holes rh ON i.rabbit_hole_id = rh.id
            ORDER BY i.created_at DESC LIMIT %s""",
         (limit,),
         fetch=True,
     )
-    return JSONResponse([dict(r) for r in (insights or [])], default=str)
+    return ORJSONResponse(
+        insights or [],
+        headers={"ETag": etag, "Cache-Control": API_CACHE_CONTROL},
+    )
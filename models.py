@@ -1,6 +1,9 @@
 """Schema migration -- run once to set up all tables."""
 
-from db import get_conn
+from db import conn_ctx
+
+# Bump whenever SCHEMA_SQL or MIGRATE_SQL changes, so apply_schema() reruns them on next startup
+SCHEMA_VERSION = 1
 
 SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS conversations (
@@ -24,6 +27,7 @@ CREATE INDEX IF NOT EXISTS idx_messages_conv ON messages(conversation_id);
 CREATE TABLE IF NOT EXISTS rabbit_holes (
     id SERIAL PRIMARY KEY,
     name TEXT NOT NULL,
+    normalized_name TEXT,
     description TEXT,
     status TEXT DEFAULT 'active',
     priority_score FLOAT DEFAULT 0.0,
@@ -31,6 +35,14 @@ CREATE TABLE IF NOT EXISTS rabbit_holes (
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
+-- Matches get_stale_rabbit_holes' filter + ORDER BY so it reads just LIMIT rows
+CREATE INDEX IF NOT EXISTS idx_rh_stale
+    ON rabbit_holes(last_researched_at ASC NULLS FIRST, priority_score DESC)
+    WHERE status = 'active';
+-- Dashboard and /api/rabbit-holes: active holes ORDER BY priority_score DESC [LIMIT 20]
+CREATE INDEX IF NOT EXISTS idx_rh_active_priority
+    ON rabbit_holes(priority_score DESC)
+    WHERE status = 'active';
 
 CREATE TABLE IF NOT EXISTS rabbit_hole_conversations (
     rabbit_hole_id INT REFERENCES rabbit_holes(id) ON DELETE CASCADE,
@@ -47,7 +59,11 @@ CREATE TABLE IF NOT EXISTS insights (
     urgency TEXT DEFAULT 'low',
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
-CREATE INDEX IF NOT EXISTS idx_insights_rh ON insights(rabbit_hole_id);
+-- Serves both rabbit_hole_id lookups and "latest insights for a hole" ORDER BY created_at DESC
+CREATE INDEX IF NOT EXISTS idx_insights_rh_created ON insights(rabbit_hole_id, created_at DESC);
+DROP INDEX IF EXISTS idx_insights_rh;
+-- Dashboard "recent insights" across all holes
+CREATE INDEX IF NOT EXISTS idx_insights_created ON insights(created_at DESC);
 
 CREATE TABLE IF NOT EXISTS research_runs (
     id SERIAL PRIMARY KEY,
@@ -57,6 +73,8 @@ CREATE TABLE IF NOT EXISTS research_runs (
     you_com_results TEXT,
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
+-- Rabbit hole page: a hole's latest runs
+CREATE INDEX IF NOT EXISTS idx_research_runs_rh_created ON research_runs(rabbit_hole_id, created_at DESC);
 
 CREATE TABLE IF NOT EXISTS daily_plans (
     id SERIAL PRIMARY KEY,
@@ -64,16 +82,61 @@ CREATE TABLE IF NOT EXISTS daily_plans (
     plan_json TEXT NOT NULL,
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
+
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    value JSONB,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+"""
+
+MIGRATE_SQL = r"""
+-- rabbit_holes.normalized_name: dedup key written by ingest._normalize_rh_name
+ALTER TABLE rabbit_holes ADD COLUMN IF NOT EXISTS normalized_name TEXT;
+UPDATE rabbit_holes
+SET normalized_name = regexp_replace(
+        regexp_replace(regexp_replace(lower(name), '^\s+|\s+$', '', 'g'), '\s+and\s+', ' & ', 'g'),
+        '\s+', ' ', 'g')
+WHERE normalized_name IS NULL;
+
+-- Fold duplicate rabbit holes into the highest-priority row of each name before enforcing uniqueness
+CREATE TEMP TABLE rh_remap ON COMMIT DROP AS
+SELECT id AS old_id, keep_id FROM (
+    SELECT id, FIRST_VALUE(id) OVER (
+               PARTITION BY normalized_name ORDER BY priority_score DESC NULLS LAST, id
+           ) AS keep_id
+    FROM rabbit_holes
+) ranked
+WHERE id <> keep_id;
+UPDATE insights i SET rabbit_hole_id = r.keep_id FROM rh_remap r WHERE i.rabbit_hole_id = r.old_id;
+UPDATE research_runs rr SET rabbit_hole_id = r.keep_id FROM rh_remap r WHERE rr.rabbit_hole_id = r.old_id;
+INSERT INTO rabbit_hole_conversations (rabbit_hole_id, conversation_id)
+SELECT r.keep_id, rhc.conversation_id
+FROM rabbit_hole_conversations rhc JOIN rh_remap r ON rhc.rabbit_hole_id = r.old_id
+ON CONFLICT DO NOTHING;
+DELETE FROM rabbit_holes WHERE id IN (SELECT old_id FROM rh_remap);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_rh_normalized_name ON rabbit_holes(normalized_name);
 """
 
 
 def apply_schema():
-    conn = get_conn()
-    conn.autocommit = True
-    cur = conn.cursor()
-    cur.execute(SCHEMA_SQL)
-    cur.close()
-    conn.close()
+    """Create/migrate the schema, unless the database already records SCHEMA_VERSION."""
+    with conn_ctx() as conn, conn.cursor() as cur:
+        cur.execute(
+            """CREATE TABLE IF NOT EXISTS schema_meta (version INT NOT NULL);
+               SELECT MAX(version) FROM schema_meta"""
+        )
+        (current,) = cur.fetchone()
+    if current is not None and current >= SCHEMA_VERSION:
+        return
+
+    with conn_ctx() as conn, conn.cursor() as cur:
+        cur.execute(SCHEMA_SQL)
+    # One transaction so the temp remap table lives exactly as long as the dedup
+    with conn_ctx(autocommit=False) as conn, conn.cursor() as cur:
+        cur.execute(MIGRATE_SQL)
+        cur.execute("DELETE FROM schema_meta; INSERT INTO schema_meta (version) VALUES (%s)", (SCHEMA_VERSION,))
     print("Schema applied successfully.")
 
 
@@ -1,10 +1,16 @@
 """DeepSeek V3.2 client via Akash ML (OpenAI-compatible)."""
 
 import os
-import json
+import time
+import hashlib
+import random
+import asyncio
 import httpx
+import orjson
 from dotenv import load_dotenv
 
+from services import clients
+
 from pathlib import Path
 load_dotenv(Path.home() / ".env")
 load_dotenv(override=True)
@@ -12,46 +18,90 @@ load_dotenv(override=True)
 AKASH_ML_API_KEY = os.getenv("AKASH_ML_API_KEY", "")
 AKASH_BASE_URL = os.getenv("AKASH_BASE_URL", "https://api.akashml.com/v1")
 AKASH_MODEL = os.getenv("AKASH_MODEL", "deepseek-ai/DeepSeek-V3.2")
+# Route ingestion classification through the Batch API (cheaper, but async/slow)
+AKASH_USE_BATCH = os.getenv("AKASH_USE_BATCH", "false").lower() == "true"
 
+# Rate limits and transient upstream errors are retried with exponential backoff
+MAX_RETRIES = 4
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
-def chat(messages: list[dict], temperature: float = 0.7, max_tokens: int = 4096) -> str:
-    """Send a chat completion request to DeepSeek V3.2 via Akash ML."""
-    resp = httpx.post(
-        f"{AKASH_BASE_URL}/chat/completions",
-        headers={
+
+def _chat_request(messages: list[dict], temperature: float, max_tokens: int) -> dict:
+    """Build the request kwargs shared by the sync and async chat clients."""
+    return {
+        "url": f"{AKASH_BASE_URL}/chat/completions",
+        "headers": {
             "Authorization": f"Bearer {AKASH_ML_API_KEY}",
             "Content-Type": "application/json",
         },
-        json={
+        "json": {
             "model": AKASH_MODEL,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
         },
-        timeout=120.0,
-    )
-    resp.raise_for_status()
-    data = resp.json()
+    }
+
+
+def _retryable(exc: httpx.HTTPError) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUSES
+    return isinstance(exc, httpx.TransportError)
+
+
+def _backoff(attempt: int) -> float:
+    return 2 ** attempt + random.random()
+
+
+def chat(messages: list[dict], temperature: float = 0.7, max_tokens: int = 4096) -> str:
+    """Send a chat completion request to DeepSeek V3.2 via Akash ML."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            resp = clients.client().post(**_chat_request(messages, temperature, max_tokens), timeout=120.0)
+            resp.raise_for_status()
+            break
+        except httpx.HTTPError as e:
+            if attempt == MAX_RETRIES or not _retryable(e):
+                raise
+            time.sleep(_backoff(attempt))
+    data = orjson.loads(resp.content)
     return data["choices"][0]["message"]["content"]
 
 
-def classify_conversations(conversations_batch: list[dict]) -> list[dict]:
-    """Given a batch of conversation summaries, return rabbit hole classifications.
+async def achat(messages: list[dict], temperature: float = 0.7, max_tokens: int = 4096) -> str:
+    """Async variant of chat() so research calls can run concurrently."""
+    client = clients.async_client()
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            resp = await client.post(**_chat_request(messages, temperature, max_tokens), timeout=120.0)
+            resp.raise_for_status()
+            break
+        except httpx.HTTPError as e:
+            if attempt == MAX_RETRIES or not _retryable(e):
+                raise
+            await asyncio.sleep(_backoff(attempt))
+    data = orjson.loads(resp.content)
+    return data["choices"][0]["message"]["content"]
 
-    Each conversation summary has: title, first_messages (str), message_count, created_at.
-    Returns list of {name, description, conversation_ids}.
-    """
-    summaries = "\n".join(
-        f"- ID: {c['id']} | Title: \"{c['title']}\" | Messages: {c['message_count']} | Sample: {c['first_messages'][:300]}"
-        for c in conversations_batch
-    )
 
-    prompt = f"""You are analyzing a user's ChatGPT conversation history to identify "rabbit holes" -- recurring topics or deep dives the user keeps exploring.
+def _parse_json_reply(raw: str):
+    """Strip potential markdown fences from a model reply and decode the JSON."""
+    cleaned = raw.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned.split("\n", 1)[1]
+    if cleaned.endswith("```"):
+        cleaned = cleaned.rsplit("```", 1)[0]
+    return orjson.loads(cleaned.strip())
+
+
+CLASSIFY_PROMPT_PREFIX = """You are analyzing a user's ChatGPT conversation history to identify "rabbit holes" -- recurring topics or deep dives the user keeps exploring.
 
 Below are conversation summaries. Group them into thematic rabbit holes. A rabbit hole is a topic the user has explored across one or more conversations.
 
 Conversations:
-{summaries}
+"""
+
+CLASSIFY_PROMPT_SUFFIX = """
 
 Return a JSON array of rabbit holes. Each rabbit hole:
 - "name": short topic name (3-6 words)
@@ -64,41 +114,47 @@ Rules:
 - Focus on substantive intellectual explorations
 - Return ONLY valid JSON, no markdown fences"""
 
+
+def _classify_prompt(conversations_batch: list[dict]) -> str:
+    summaries = "\n".join(
+        f"- ID: {c['id']} | Title: \"{c['title']}\" | Messages: {c['message_count']} | Sample: {c['first_messages'][:300]}"
+        for c in conversations_batch
+    )
+    return CLASSIFY_PROMPT_PREFIX + summaries + CLASSIFY_PROMPT_SUFFIX
+
+
+def classify_conversations(conversations_batch: list[dict]) -> list[dict]:
+    """Given a batch of conversation summaries, return rabbit hole classifications.
+
+    Each conversation summary has: title, first_messages (str), message_count, created_at.
+    Returns list of {name, description, conversation_ids}.
+    """
+    prompt = _classify_prompt(conversations_batch)
     raw = chat([{"role": "user", "content": prompt}], temperature=0.3, max_tokens=4096)
-    # Strip potential markdown fences
-    cleaned = raw.strip()
-    if cleaned.startswith("```"):
-        cleaned = cleaned.split("\n", 1)[1]
-    if cleaned.endswith("```"):
-        cleaned = cleaned.rsplit("```", 1)[0]
-    cleaned = cleaned.strip()
-    return json.loads(cleaned)
+    return _parse_json_reply(raw)
 
 
-def generate_research_queries(rabbit_hole_name: str, description: str, recent_insights: str) -> list[str]:
-    """Generate web search queries for a rabbit hole."""
-    prompt = f"""You are a research assistant. Given this "rabbit hole" topic the user has been exploring, generate 2-3 specific web search queries to find new developments, insights, or resources.
+RESEARCH_QUERIES_PROMPT = """You are a research assistant. Given this "rabbit hole" topic the user has been exploring, generate 2-3 specific web search queries to find new developments, insights, or resources.
 
-Rabbit Hole: {rabbit_hole_name}
+Rabbit Hole: {name}
 Description: {description}
-Recent insights (if any): {recent_insights or "None yet"}
+Recent insights (if any): {recent_insights}
 
 Return ONLY a JSON array of search query strings. No markdown, no explanation."""
 
-    raw = chat([{"role": "user", "content": prompt}], temperature=0.5, max_tokens=512)
-    cleaned = raw.strip()
-    if cleaned.startswith("```"):
-        cleaned = cleaned.split("\n", 1)[1]
-    if cleaned.endswith("```"):
-        cleaned = cleaned.rsplit("```", 1)[0]
-    return json.loads(cleaned.strip())
 
+async def agenerate_research_queries(rabbit_hole_name: str, description: str, recent_insights: str) -> list[str]:
+    """Generate web search queries for a rabbit hole."""
+    prompt = RESEARCH_QUERIES_PROMPT.format(
+        name=rabbit_hole_name, description=description, recent_insights=recent_insights or "None yet",
+    )
+    raw = await achat([{"role": "user", "content": prompt}], temperature=0.5, max_tokens=512)
+    return _parse_json_reply(raw)
 
-def synthesize_research(rabbit_hole_name: str, description: str, search_results: str) -> dict:
-    """Synthesize search results into an insight."""
-    prompt = f"""You are analyzing web search results for a user's rabbit hole topic.
 
-Rabbit Hole: {rabbit_hole_name}
+SYNTHESIS_PROMPT = """You are analyzing web search results for a user's rabbit hole topic.
+
+Rabbit Hole: {name}
 Description: {description}
 
 Search Results:
@@ -112,13 +168,18 @@ Analyze these results and return a JSON object:
 
 Return ONLY valid JSON, no markdown fences."""
 
-    raw = chat([{"role": "user", "content": prompt}], temperature=0.4, max_tokens=1024)
-    cleaned = raw.strip()
-    if cleaned.startswith("```"):
-        cleaned = cleaned.split("\n", 1)[1]
-    if cleaned.endswith("```"):
-        cleaned = cleaned.rsplit("```", 1)[0]
-    return json.loads(cleaned.strip())
+
+# Changes whenever a prompt template is edited; part of llm_cache keys, so cached answers to an old prompt are not reused
+PROMPT_VERSION = hashlib.sha256(
+    "\0".join((CLASSIFY_PROMPT_PREFIX, CLASSIFY_PROMPT_SUFFIX, RESEARCH_QUERIES_PROMPT, SYNTHESIS_PROMPT)).encode()
+).hexdigest()[:16]
+
+
+async def asynthesize_research(rabbit_hole_name: str, description: str, search_results: str) -> dict:
+    """Synthesize search results into an insight."""
+    prompt = SYNTHESIS_PROMPT.format(name=rabbit_hole_name, description=description, search_results=search_results)
+    raw = await achat([{"role": "user", "content": prompt}], temperature=0.4, max_tokens=1024)
+    return _parse_json_reply(raw)
 
 
 def generate_daily_plan(rabbit_holes_with_insights: list[dict]) -> str:
@@ -0,0 +1,125 @@
+"""OpenAI-style Batch API client for Akash ML, used for non-latency-critical ingestion."""
+
+import time
+
+import httpx
+import orjson
+
+from services.akash import AKASH_BASE_URL, AKASH_ML_API_KEY, AKASH_MODEL, _classify_prompt, _parse_json_reply
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def _headers() -> dict:
+    return {"Authorization": f"Bearer {AKASH_ML_API_KEY}"}
+
+
+def submit_batch(prompts: list[dict]) -> str:
+    """Upload prompts as a JSONL file and start a batch job; returns the batch id.
+
+    Each prompt is {custom_id, messages, temperature, max_tokens}.
+    """
+    lines = [
+        orjson.dumps({
+            "custom_id": p["custom_id"],
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": AKASH_MODEL,
+                "messages": p["messages"],
+                "temperature": p.get("temperature", 0.7),
+                "max_tokens": p.get("max_tokens", 4096),
+            },
+        })
+        for p in prompts
+    ]
+    upload = httpx.post(
+        f"{AKASH_BASE_URL}/files",
+        headers=_headers(),
+        data={"purpose": "batch"},
+        files={"file": ("batch.jsonl", b"\n".join(lines), "application/jsonl")},
+        timeout=120.0,
+    )
+    upload.raise_for_status()
+
+    resp = httpx.post(
+        f"{AKASH_BASE_URL}/batches",
+        headers=_headers(),
+        json={
+            "input_file_id": orjson.loads(upload.content)["id"],
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+        },
+        timeout=30.0,
+    )
+    resp.raise_for_status()
+    return orjson.loads(resp.content)["id"]
+
+
+def poll_batch(batch_id: str, initial_delay: float = 5.0, max_delay: float = 300.0) -> dict:
+    """Poll a batch job with exponential backoff until it reaches a terminal status."""
+    delay = initial_delay
+    while True:
+        resp = httpx.get(f"{AKASH_BASE_URL}/batches/{batch_id}", headers=_headers(), timeout=30.0)
+        resp.raise_for_status()
+        batch = orjson.loads(resp.content)
+        if batch["status"] in TERMINAL_STATUSES:
+            if batch["status"] != "completed":
+                raise RuntimeError(f"Batch {batch_id} ended with status {batch['status']}")
+            return batch
+        print(f"  Batch {batch_id}: {batch['status']}, checking again in {delay:.0f}s...")
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def fetch_batch_results(batch: dict) -> dict[str, str]:
+    """Download a completed batch's output file; returns {custom_id: completion text}."""
+    if not batch.get("output_file_id"):
+        # Every request failed; the details are in the error file, if any
+        print(f"  Batch {batch['id']} produced no output (error file: {batch.get('error_file_id')})")
+        return {}
+    resp = httpx.get(
+        f"{AKASH_BASE_URL}/files/{batch['output_file_id']}/content",
+        headers=_headers(),
+        timeout=120.0,
+    )
+    resp.raise_for_status()
+    results = {}
+    for line in resp.content.splitlines():
+        if not line.strip():
+            continue
+        row = orjson.loads(line)
+        body = (row.get("response") or {}).get("body")
+        if not body:
+            print(f"  Batch request {row.get('custom_id')} failed: {row.get('error')}")
+            continue
+        results[row["custom_id"]] = body["choices"][0]["message"]["content"]
+    return results
+
+
+def classify_conversations_batched(batches: list[list[dict]]) -> list[dict]:
+    """Classify every conversation-summary batch in a single Batch API job.
+
+    Same prompt and output as classify_conversations(), one JSONL line per batch.
+    """
+    if not batches:
+        return []
+    prompts = [
+        {
+            "custom_id": f"classify-{i}",
+            "messages": [{"role": "user", "content": _classify_prompt(batch)}],
+            "temperature": 0.3,
+            "max_tokens": 4096,
+        }
+        for i, batch in enumerate(batches)
+    ]
+    batch_id = submit_batch(prompts)
+    print(f"  Submitted batch {batch_id} with {len(prompts)} classification requests.")
+    results = fetch_batch_results(poll_batch(batch_id))
+
+    all_holes = []
+    for p in prompts:
+        raw = results.get(p["custom_id"])
+        if raw is not None:
+            all_holes.extend(_parse_json_reply(raw))
+    return all_holes
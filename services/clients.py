@@ -0,0 +1,44 @@
+"""Shared HTTP clients, so DeepSeek and You.com calls reuse pooled keep-alive connections."""
+
+import threading
+
+import httpx
+
+LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+
+
+def client() -> httpx.Client:
+    """Process-wide sync client; thread-safe, used by ingest's classifier threads."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(limits=LIMITS)
+    return _client
+
+
+def async_client() -> httpx.AsyncClient:
+    """Async client for the running event loop; call aclose() before that loop ends."""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(limits=LIMITS)
+    return _async_client
+
+
+async def aclose():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def close():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
@@ -1,9 +1,11 @@
 """You.com Search API wrapper for grounding DeepSeek outputs."""
 
 import os
-import httpx
+import orjson
 from dotenv import load_dotenv
 
+from services import clients
+
 from pathlib import Path
 load_dotenv(Path.home() / ".env")
 load_dotenv(override=True)
@@ -12,16 +14,7 @@ YOU_API_KEY = os.getenv("YOU_API_KEY", "")
 YOU_BASE_URL = "https://ydc-index.io/v1/search"
 
 
-def search(query: str, num_results: int = 5) -> list[dict]:
-    """Search You.com and return structured results."""
-    resp = httpx.get(
-        YOU_BASE_URL,
-        params={"query": query, "count": num_results},
-        headers={"X-API-Key": YOU_API_KEY},
-        timeout=30.0,
-    )
-    resp.raise_for_status()
-    data = resp.json()
+def _parse_results(data: dict) -> list[dict]:
     results_data = data.get("results", {})
     hits = results_data.get("web", [])
     results = []
@@ -35,12 +28,27 @@ def search(query: str, num_results: int = 5) -> list[dict]:
     return results
 
 
-def search_and_format(query: str, num_results: int = 5) -> str:
-    """Search and return a formatted string for LLM consumption."""
-    results = search(query, num_results)
+def _format_results(results: list[dict]) -> str:
     if not results:
         return "No results found."
     parts = []
     for i, r in enumerate(results, 1):
         parts.append(f"[{i}] {r['title']}\n    URL: {r['url']}\n    {r['snippet']}")
     return "\n\n".join(parts)
+
+
+async def asearch(query: str, num_results: int = 5) -> list[dict]:
+    """Search You.com and return structured results."""
+    resp = await clients.async_client().get(
+        YOU_BASE_URL,
+        params={"query": query, "count": num_results},
+        headers={"X-API-Key": YOU_API_KEY},
+        timeout=30.0,
+    )
+    resp.raise_for_status()
+    return _parse_results(orjson.loads(resp.content))
+
+
+async def asearch_and_format(query: str, num_results: int = 5) -> str:
+    """Search and return a formatted string for LLM consumption."""
+    return _format_results(await asearch(query, num_results))